@@ -18,20 +18,68 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from pathlib import Path
-from zlib import adler32 as zlib_adler32
-from json import dump as json_dump, load as json_load, JSONDecodeError
+from os import cpu_count
+from typing import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from stat import S_ISDIR
+from mmap import mmap, ACCESS_READ
+from json import JSONDecodeError
+
+# orjson parses and serializes considerably faster than the standard library, its JSONDecodeError is a subclass of the
+# standard one.
+try:
+    from orjson import dumps as _orjson_dumps, loads as json_loads, OPT_INDENT_2
+
+    def json_dumps(obj) -> bytes:
+        return _orjson_dumps(obj, option=OPT_INDENT_2)
+
+except ImportError:
+    from json import dumps as _json_dumps, loads as json_loads
+
+    def json_dumps(obj) -> bytes:
+        return _json_dumps(obj, indent=2).encode()
+
+
+# Checksums only need to detect changes, so prefer the much faster non-cryptographic xxh3 when it's available.
+try:
+    from xxhash import xxh3_64_intdigest as checksum
+
+    F4CACHE_CHECKSUM = "xxh3_64"
+except ImportError:
+    from zlib import adler32 as checksum
+
+    F4CACHE_CHECKSUM = "adler32"
 
 from f4pga.flows.common import sfprint
 
+# Version of the layout of the persistent storage, caches stored with a different one are discarded.
+F4CACHE_VERSION = 2
+
+# Files smaller than that are read at once, as mapping them into memory costs more than copying them.
+MMAP_MIN_SIZE = 64 * 1024
+
+
+def file_checksum(path: Path, size: int):
+    """Calculate checksum of a file of a given size, without copying large files into memory."""
+
+    with path.open("rb") as rfptr:
+        if size < MMAP_MIN_SIZE:
+            return checksum(rfptr.read())
+        with mmap(rfptr.fileno(), 0, access=ACCESS_READ) as mapped:
+            return checksum(mapped)
+
 
 class F4Cache:
     """
     `F4Cache` is used to track changes among dependencies and keep the status of the files on a persistent storage.
     Files which are tracked get their checksums calculated and stored in a file.
     If file's checksum differs from the one saved in a file, that means, the file has changed.
+    Checksums are recalculated only for files whose modification time or size changed since they were last hashed.
     """
 
     hashes: "dict[str, dict[str, str]]"
+    # Modification time (ns), size and checksum of each file at the moment it was last hashed
+    file_stats: "dict[str, list[int]]"
     current_hashes: "dict[str, str]"
     status: "dict[str, str]"
     cachefile_path: str
@@ -69,14 +117,38 @@ class F4Cache:
     def process_file(self, path: Path):
         """Process file for tracking with f4cache."""
 
-        if path.is_dir():
+        posix_path = path.as_posix()
+        st = path.stat()
+
+        if S_ISDIR(st.st_mode):
             # Directories always get '0' hash.
             hash = 0
         else:
-            with path.open("rb") as rfptr:
-                hash = zlib_adler32(rfptr.read())
+            last = self.file_stats.get(posix_path)
+            if last is not None and last[0] == st.st_mtime_ns and last[1] == st.st_size:
+                hash = last[2]
+            else:
+                hash = file_checksum(path, st.st_size)
+                self.file_stats[posix_path] = [st.st_mtime_ns, st.st_size, hash]
+
+        self.current_hashes[posix_path] = hash
 
-        self.current_hashes[path.as_posix()] = hash
+    def process_files(self, paths: "Iterable[Path]"):
+        """Process multiple files for tracking with f4cache.
+
+        Files are hashed concurrently, as reading them and calculating checksums both release the GIL.
+        """
+
+        paths = list(paths)
+        if len(paths) < 2:
+            for path in paths:
+                self.process_file(path)
+            return
+
+        with ThreadPoolExecutor(max_workers=min(8, cpu_count() or 1, len(paths))) as executor:
+            # Consume the results to re-raise exceptions from the workers
+            for _ in executor.map(self.process_file, paths):
+                pass
 
     def update(self, path: Path, consumer: str):
         """Add/remove a file to.from the tracked files, update checksum if necessary and calculate status.
@@ -130,25 +202,47 @@ class F4Cache:
     def load(self):
         """Loads cache's state from the persistent storage"""
 
+        self.hashes = {}
+        self.file_stats = {}
+
         try:
-            with Path(self.cachefile_path).open("r") as rfptr:
-                self.hashes = json_load(rfptr)
+            data = json_loads(Path(self.cachefile_path).read_bytes())
         except JSONDecodeError:
             sfprint(
                 0,
                 f"WARNING: `{self.cachefile_path}` f4cache is corrupted!\n"
                 "This will cause flow to re-execute from the beginning.",
             )
-            self.hashes = {}
+            return
         except FileNotFoundError:
             sfprint(
                 0,
                 f"Couldn't open `{self.cachefile_path}` cache file.\n"
                 "This will cause flow to re-execute from the beginning.",
             )
-            self.hashes = {}
+            return
+
+        if (
+            not isinstance(data, dict)
+            or data.get("version") != F4CACHE_VERSION
+            or data.get("checksum") != F4CACHE_CHECKSUM
+        ):
+            sfprint(
+                0,
+                f"WARNING: `{self.cachefile_path}` f4cache was created by a different version of f4pga.\n"
+                "This will cause flow to re-execute from the beginning.",
+            )
+            return
+
+        self.hashes = data["hashes"]
+        self.file_stats = data["files"]
 
     def save(self):
         """Saves cache's state to the persistent storage."""
-        with Path(self.cachefile_path).open("w") as wfptr:
-            json_dump(self.hashes, wfptr, indent=4)
+        # Drop stats of files which are no longer tracked
+        file_stats = {path: stats for path, stats in self.file_stats.items() if path in self.hashes}
+        Path(self.cachefile_path).write_bytes(
+            json_dumps(
+                {"version": F4CACHE_VERSION, "checksum": F4CACHE_CHECKSUM, "hashes": self.hashes, "files": file_stats}
+            )
+        )
@@ -17,14 +17,22 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-from sys import exit as sys_exit
+from sys import exit as sys_exit, executable as sys_executable
 from typing import Iterable
 from pathlib import Path
-from os import environ
+from os import environ, getpid, replace as os_replace
 from argparse import Namespace
+from hashlib import sha256
+from pickle import dumps as pickle_dumps, loads as pickle_loads
+from struct import pack
 
 from colorama import Fore, Style
-from yaml import load as yaml_load, Loader as yaml_loader
+from yaml import load as yaml_load
+
+try:
+    from yaml import CSafeLoader as yaml_loader
+except ImportError:
+    from yaml import SafeLoader as yaml_loader
 
 from f4pga.context import FPGA_FAM
 from f4pga.flows.common import (
@@ -54,39 +62,39 @@ from f4pga.flows.inspector import get_module_info
 
 ROOT = Path(__file__).resolve().parent
 
+# Descriptions of dependency specs displayed by `display_dep_info`
+DEP_SPEC_STRS = {
+    "req": f"{Fore.BLUE}guaranteed{Fore.RESET}",
+    "maybe": f"{Fore.YELLOW}not guaranteed{Fore.RESET}",
+    "demand": f"{Fore.RED}on-demand{Fore.RESET}",
+}
+
 F4CACHEPATH = ".f4cache"
 
+# Contents of `part_db.yml` (inverted into a part -> platform map) and `platforms.yml`, loaded on first use
+_PART_DB: "dict[str, str] | None" = None
+_PLATFORMS: "dict[str, dict] | None" = None
+# Output of `prjxray-config`, queried on first use
+_PRJXRAY_DB: "str | None" = None
+
 
 def display_dep_info(stages: "Iterable[Stage]"):
-    sfprint(0, "Platform dependencies/targets:")
-    longest_out_name_len = 0
-    for stage in stages:
-        for out in stage.produces:
-            l = len(out.name)
-            if l > longest_out_name_len:
-                longest_out_name_len = l
+    longest_out_name_len = max((len(out.name) for stage in stages for out in stage.produces), default=0)
 
     desc_indent = longest_out_name_len + 7
-    nl_indentstr = "\n"
-    for _ in range(0, desc_indent):
-        nl_indentstr += " "
+    nl_indentstr = "\n" + " " * desc_indent
 
+    lines = ["Platform dependencies/targets:"]
     for stage in stages:
+        stage_str = f"{Style.DIM}stage: `{stage.name}`, spec: "
         for out in stage.produces:
-            pname = Style.BRIGHT + out.name + Style.RESET_ALL
-            indent = ""
-            for _ in range(0, desc_indent - len(pname) + 3):
-                indent += " "
-            specstr = "???"
-            if out.spec == "req":
-                specstr = f"{Fore.BLUE}guaranteed{Fore.RESET}"
-            elif out.spec == "maybe":
-                specstr = f"{Fore.YELLOW}not guaranteed{Fore.RESET}"
-            elif out.spec == "demand":
-                specstr = f"{Fore.RED}on-demand{Fore.RESET}"
-            pgen = f"{Style.DIM}stage: `{stage.name}`, " f"spec: {specstr}{Style.RESET_ALL}"
+            pname = f"{Style.BRIGHT}{out.name}{Style.RESET_ALL}"
+            indent = " " * (desc_indent - len(pname) + 3)
+            pgen = f"{stage_str}{DEP_SPEC_STRS.get(out.spec, '???')}{Style.RESET_ALL}"
             pdesc = stage.meta[out.name].replace("\n", nl_indentstr)
-            sfprint(0, f"    {Style.BRIGHT + out.name + Style.RESET_ALL}:" f"{indent}{pdesc}{nl_indentstr}{pgen}")
+            lines.append(f"    {pname}:{indent}{pdesc}{nl_indentstr}{pgen}")
+
+    sfprint(0, "\n".join(lines))
 
 
 def display_stage_info(stage: Stage):
@@ -118,6 +126,16 @@ def f4pga_done():
     sys_exit(0 if "FAILED" not in f4pga_done_str else 1)
 
 
+def _get_prjxray_db() -> str:
+    """
+    Queries `prjxray-config` for the location of the Project X-Ray database once per process.
+    """
+    global _PRJXRAY_DB
+    if _PRJXRAY_DB is None:
+        _PRJXRAY_DB = common_sub("prjxray-config").decode().replace("\n", "")
+    return _PRJXRAY_DB
+
+
 def setup_resolution_env():
     """Sets up a ResolutionEnv with default built-ins."""
 
@@ -135,11 +153,12 @@ def setup_resolution_env():
         Generate initial values, available in configs.
         """
         conf = {
-            "python3": common_sub("which", "python3").decode().replace("\n", ""),
+            # Use the interpreter running f4pga, unless it can't tell its own location
+            "python3": sys_executable or common_sub("which", "python3").decode().replace("\n", ""),
             "noisyWarnings": _noisy_warnings(),
         }
         if FPGA_FAM == "xc7":
-            conf["prjxray_db"] = common_sub("prjxray-config").decode().replace("\n", "")
+            conf["prjxray_db"] = _get_prjxray_db()
 
         return conf
 
@@ -168,38 +187,124 @@ def verify_part_stage_params(flow_cfg: FlowConfig, part: "str | None" = None):
     return True
 
 
+def _sidecar_path(path: Path) -> Path:
+    """
+    Gets the location of the cache of a parsed YAML file, in the per-user cache directory.
+    Name of the file is derived from the path of the source, so that different installations don't share it.
+    """
+    cache_home = environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    key = sha256(str(path.resolve()).encode()).hexdigest()[:16]
+    return Path(cache_home) / "f4pga" / f"{path.stem}-{key}.pkl"
+
+
+def _load_yaml_with_sidecar(path: Path, process=None):
+    """
+    Loads a YAML file shipped with the package, optionally post-processing its contents with `process`.
+    The result is pickled to a sidecar file in the per-user cache directory, which is used instead of parsing the YAML
+    for as long as the modification time and size recorded in its header match the source.
+    """
+
+    src_stat = path.stat()
+    header = pack("<qq", src_stat.st_mtime_ns, src_stat.st_size)
+    try:
+        sidecar = _sidecar_path(path)
+    except (KeyError, RuntimeError):
+        # Home directory can't be determined, so there's nowhere to cache the contents
+        sidecar = None
+
+    if sidecar is not None:
+        try:
+            data = sidecar.read_bytes()
+            if data[: len(header)] == header:
+                return pickle_loads(data[len(header) :])
+        except Exception:
+            # Missing, stale or corrupted sidecar, fall back to parsing the source
+            pass
+
+    with path.open("r") as rfptr:
+        content = yaml_load(rfptr, yaml_loader)
+    if process is not None:
+        content = process(content)
+
+    if sidecar is None:
+        return content
+
+    tmp = sidecar.with_name(f"{sidecar.name}.{getpid()}.tmp")
+    try:
+        sidecar.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_bytes(header + pickle_dumps(content))
+        os_replace(str(tmp), str(sidecar))
+    except OSError:
+        # Caching is only an optimization, the YAML gets parsed every time if the cache directory isn't writable
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+
+    return content
+
+
+def _load_part_db() -> "dict[str, str]":
+    """
+    Loads `part_db.yml` once per process and returns it as a map from upper-case part names to platform names.
+    """
+    global _PART_DB
+    if _PART_DB is None:
+        _PART_DB = _load_yaml_with_sidecar(
+            ROOT / "part_db.yml",
+            lambda raw: {part.upper(): platform for platform, parts in raw.items() for part in parts},
+        )
+    return _PART_DB
+
+
+def _load_platforms() -> "dict[str, dict]":
+    """
+    Loads `platforms.yml` once per process.
+    """
+    global _PLATFORMS
+    if _PLATFORMS is None:
+        _PLATFORMS = _load_yaml_with_sidecar(ROOT / "platforms.yml")
+    return _PLATFORMS
+
+
 def get_platform_name_for_part(part_name: str):
     """
     Gets a name that identifies the platform setup required for a specific chip.
     The reason for such distinction is that plenty of chips with different names
     differ only in a type of package they use.
     """
-    with (ROOT / "part_db.yml").open("r") as rfptr:
-        for key, val in yaml_load(rfptr, yaml_loader).items():
-            if part_name.upper() in val:
-                return key
-        raise Exception(f"Unknown part name <{part_name}>!")
+    try:
+        return _load_part_db()[part_name.upper()]
+    except KeyError:
+        raise Exception(f"Unknown part name <{part_name}>!") from None
 
 
-def make_flow_config(project_flow_cfg: ProjectFlowConfig, part_name: str) -> FlowConfig:
-    """Create `FlowConfig` from given project flow configuration and part name"""
+def get_platform_flow_def(project_flow_cfg: ProjectFlowConfig, part_name: str) -> dict:
+    """Get the raw platform flow definition for given part name"""
 
-    platform = get_platform_name_for_part(part_name)
-    if platform is None:
+    if part_name is None:
         raise F4PGAException(message="You have to specify a part name or configure a default part.")
+    platform = get_platform_name_for_part(part_name)
 
     if part_name not in project_flow_cfg.parts():
         raise F4PGAException(message="Project flow configuration does not support requested part.")
 
-    r_env = setup_resolution_env()
-    r_env.add_values({"part_name": part_name.lower()})
-
-    with (ROOT / "platforms.yml").open("r") as rfptr:
-        platforms = yaml_load(rfptr, yaml_loader)
+    platforms = _load_platforms()
     if platform not in platforms:
         raise F4PGAException(message=f"Flow definition for platform <{platform}> cannot be found!")
 
-    flow_cfg = FlowConfig(project_flow_cfg, FlowDefinition(platforms[platform], r_env), part_name)
+    return platforms[platform]
+
+
+def make_flow_config(project_flow_cfg: ProjectFlowConfig, part_name: str) -> FlowConfig:
+    """Create `FlowConfig` from given project flow configuration and part name"""
+
+    platform_flow_def = get_platform_flow_def(project_flow_cfg, part_name)
+
+    r_env = setup_resolution_env()
+    r_env.add_values({"part_name": part_name.lower()})
+
+    flow_cfg = FlowConfig(project_flow_cfg, FlowDefinition(platform_flow_def, r_env), part_name)
 
     if len(flow_cfg.stages) == 0:
         raise F4PGAException(message="Platform flow does not define any stage")
@@ -226,15 +331,18 @@ def cmd_build(args: Namespace):
 
     override_prj_flow_cfg_by_cli(project_flow_cfg, get_cli_flow_config(args, part_name))
 
-    flow_cfg = make_flow_config(project_flow_cfg, part_name)
-
-    if args.info:
-        display_dep_info(flow_cfg.stages.values())
+    if args.info or args.stageinfo:
+        # Stage descriptions don't depend on the resolution environment, so don't spawn the subprocesses needed
+        # to set it up, and load only the modules of the stages that are going to be displayed.
+        stage_defs = get_platform_flow_def(project_flow_cfg, part_name)["stages"]
+        if args.info:
+            display_dep_info([Stage(name, stage_def) for name, stage_def in stage_defs.items()])
+        else:
+            name = args.stageinfo[0]
+            display_stage_info(Stage(name, stage_defs[name]) if name in stage_defs else None)
         f4pga_done()
 
-    if args.stageinfo:
-        display_stage_info(flow_cfg.stages.get(args.stageinfo[0]))
-        f4pga_done()
+    flow_cfg = make_flow_config(project_flow_cfg, part_name)
 
     target = args.target
     if target is None:
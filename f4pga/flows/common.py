@@ -18,7 +18,7 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from pathlib import Path
-from os import environ, listdir as os_listdir
+from os import environ, listdir as os_listdir, scandir as os_scandir
 from sys import argv as sys_argv
 from argparse import Namespace
 from shutil import move as sh_mv
@@ -64,14 +64,27 @@ def with_qualifier(name: str, q: str) -> str:
         return decompose_depname(name)[0] + "!"
 
 
+# Module name -> module path mapping, populated on the first call to `resolve_modstr`
+_module_paths = None
+
+
 def resolve_modstr(modstr: str):
     """
     Resolves module location given its name.
+    The modules directory is scanned only once per process.
     """
-    modpath = Path(__file__).resolve().parent / f"modules/{modstr}.py"
-    if not modpath.exists():
+    global _module_paths
+
+    if _module_paths is None:
+        with os_scandir(Path(__file__).resolve().parent / "modules") as entries:
+            _module_paths = {
+                entry.name[:-3]: entry.path for entry in entries if entry.name.endswith(".py") and entry.is_file()
+            }
+
+    modpath = _module_paths.get(modstr)
+    if modpath is None:
         raise Exception(f"Unknown module <{modstr}>!")
-    return str(modpath)
+    return modpath
 
 
 def deep(fun, allow_none=False):
@@ -18,15 +18,32 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from pathlib import Path
+from collections import deque
 
 from colorama import Fore, Style
 
-from f4pga.flows.common import deep, sfprint, bin_dir_path, share_dir_path, F4PGAException
+from f4pga.flows.common import (
+    fatal,
+    sfprint,
+    bin_dir_path,
+    share_dir_path,
+    F4PGAException,
+    ResolutionEnv,
+)
 from f4pga.flows.cache import F4Cache
 from f4pga.flows.flow_config import FlowConfig
 from f4pga.flows.runner import ModRunCtx, module_map, module_exec
 from f4pga.flows.stage import Stage
 
+# Dependency statuses reported by `Flow.print_resolved_dependencies`, each opening the highlighted part of a line
+STATUS_UNRESOLVED = f"{Style.BRIGHT}{Fore.RED}[X]{Fore.RESET}"
+STATUS_UNREACHABLE = f"{Style.BRIGHT}{Fore.RED}[U]{Fore.RESET}"
+STATUS_REBUILD = f"{Style.BRIGHT}{Fore.YELLOW}[R]{Fore.RESET}"
+STATUS_SCHEDULED = f"{Style.BRIGHT}{Fore.YELLOW}[S]{Fore.RESET}"
+STATUS_CHANGED = f"{Style.BRIGHT}{Fore.GREEN}[N]{Fore.RESET}"
+STATUS_UNCHANGED = f"{Style.BRIGHT}{Fore.GREEN}[O]{Fore.RESET}"
+SOURCE_MISSING = f"{Fore.YELLOW}MISSING{Fore.RESET}"
+
 
 class Flow:
     """Describes a complete, configured flow, ready for execution."""
@@ -47,21 +64,31 @@ class Flow:
     deps_rebuilds: "dict[str, int]"
     f4cache: "F4Cache | None"
     flow_cfg: FlowConfig
+    # Memoized results of existence checks for dependency paths
+    _exists_cache: "dict[str, bool]"
+    # Contexts for executing stages, prepared during dependency resolution
+    _modrunctx: "dict[str, ModRunCtx]"
+    # Stages to visit when building the target, paired with their outputs that need to be built
+    _build_order: "list[tuple[Stage, list[str]]]"
+    # Memoized resolution environments of stages
+    _r_envs: "dict[str, ResolutionEnv]"
 
     def __init__(self, target: str, cfg: FlowConfig, f4cache: "F4Cache | None"):
         self.target = target
+        self._exists_cache = {}
+        self._modrunctx = {}
+        self._r_envs = {}
 
         # Associate a stage with every possible output.
         # This is commonly refferef to as `os_map` (output-stage-map) through the code.
         os_map: "dict[str, Stage]" = {}  # Output-Stage map
         for stage in cfg.stages.values():
             for output in stage.produces:
-                if not os_map.get(output.name):
-                    os_map[output.name] = stage
-                elif os_map[output.name] != stage:
+                provider = os_map.setdefault(output.name, stage)
+                if provider is not stage:
                     raise Exception(
                         f"Dependency `{output.name}` is generated by "
-                        f"stage `{os_map[output.name].name}` and "
+                        f"stage `{provider.name}` and "
                         f"`{stage.name}`. Dependencies can have only one "
                         "provider at most."
                     )
@@ -70,47 +97,82 @@ class Flow:
         self.dep_paths = {
             n: p
             for n, p in cfg.get_dependency_overrides().items()
-            if (p is not None) and p_req_exists(p)  # and not p_dep_differ(p, f4cache)
+            if (p is not None) and self._req_exists(p)  # and not self._dep_differ(p, consumer)
         }
         if f4cache is not None:
-            for dep in self.dep_paths.values():
-                self._cache_deps(dep, f4cache)
+            self._cache_deps(list(self.dep_paths.values()), f4cache)
 
         self.run_stages = set()
         self.f4cache = f4cache
         self.cfg = cfg
         self.deps_rebuilds = {}
 
-        self._resolve_dependencies(self.target, set())
+        self._resolve_dependencies(self.target)
+        self._build_order = self._plan_build()
 
     @staticmethod
-    def _config_mod_runctx(
-        stage: Stage,
-        values: "dict[str, ]",
-        dep_paths: "dict[str, str | list[str]]",
-        config_paths: "dict[str, str | list[str]]",
-    ):
+    def _mod_runctx_takes(stage: Stage, dep_paths: "dict[str, str | list[str]]"):
         takes = {}
         for take in stage.takes:
             paths = dep_paths.get(take.name)
             if paths:  # Some takes may be not required
                 takes[take.name] = paths
+        return takes
 
+    @staticmethod
+    def _mod_runctx_produces(
+        stage: Stage, dep_paths: "dict[str, str | list[str]]", config_paths: "dict[str, str | list[str]]"
+    ):
         produces = {}
         for prod in stage.produces:
             if dep_paths.get(prod.name):
                 produces[prod.name] = dep_paths[prod.name]
             elif config_paths.get(prod.name):
                 produces[prod.name] = config_paths[prod.name]
+        return produces
+
+    @staticmethod
+    def _config_mod_runctx(
+        stage: Stage,
+        values: "dict[str, ]",
+        dep_paths: "dict[str, str | list[str]]",
+        config_paths: "dict[str, str | list[str]]",
+    ):
+        takes = Flow._mod_runctx_takes(stage, dep_paths)
+        produces = Flow._mod_runctx_produces(stage, dep_paths, config_paths)
 
         return ModRunCtx(share_dir_path, bin_dir_path, {"takes": takes, "produces": produces, "values": values})
 
-    @staticmethod
-    def _cache_deps(path: str, f4cache: F4Cache):
-        def _process_dep_path(path: str, f4cache: F4Cache):
-            f4cache.process_file(Path(path))
+    def _exec_mod_runctx(self, stage: Stage):
+        """
+        Get the context for executing a stage.
+        The one prepared during dependency resolution is reused, unless paths of stage's inputs changed since then.
+        """
+        modrunctx = self._modrunctx.get(stage.name)
+        if modrunctx is None or modrunctx.config["takes"] != self._mod_runctx_takes(stage, self.dep_paths):
+            modrunctx = self._config_mod_runctx(
+                stage, self.cfg.get_r_env(stage.name).values, self.dep_paths, self.cfg.get_dependency_overrides()
+            )
+        return modrunctx
 
-        deep(_process_dep_path)(path, f4cache)
+    def _req_exists(self, r):
+        """
+        Checks whether a dependency exists on a drive.
+        Results are memoized until the cache is cleared after a module gets executed.
+        """
+        if isinstance(r, str):
+            exists = self._exists_cache.get(r)
+            if exists is None:
+                exists = Path(r).exists()
+                self._exists_cache[r] = exists
+            return exists
+        elif isinstance(r, list):
+            return all(self._req_exists(p) for p in r)
+        raise Exception(f"Requirements can be currently checked only for single paths, or path lists (reason: {r})")
+
+    @staticmethod
+    def _cache_deps(paths, f4cache: F4Cache):
+        f4cache.process_files(Path(path) for path in p_iter_paths(paths))
 
     def _dep_will_differ(self, dep: str, paths, consumer: str):
         """
@@ -122,29 +184,85 @@ class Flow:
         provider = self.os_map.get(dep)
         if provider and (provider.name in self.run_stages):
             return True
-        return p_dep_differ(paths, consumer, self.f4cache)
-
-    def _resolve_dependencies(self, dep: str, stages_checked: "set[str]", skip_dep_warnings: "set[str]" = None):
-        if skip_dep_warnings is None:
-            skip_dep_warnings = set()
+        return self._dep_differ(paths, consumer)
 
+    def _dep_differ(self, paths, consumer: str):
+        """
+        Check if a dependency differs from its last version, lack of dependency is treated as "differs".
+        Stops at the first path that differs.
+        """
+        pending = [paths]
+        while pending:
+            paths = pending.pop()
+            if isinstance(paths, str):
+                if not self._req_exists(paths) or self.f4cache.get_status(paths, consumer) != "same":
+                    return True
+            elif isinstance(paths, list):
+                pending.extend(paths)
+            elif isinstance(paths, dict):
+                pending.extend(paths.values())
+        return False
+
+    def _stages_in_order(self, dep: str) -> "list[Stage]":
+        """
+        Collect stages required to provide `dep` and sort them topologically (Kahn's algorithm), so that every stage
+        comes after the providers of its inputs.
+        """
+        stages: "dict[str, Stage]" = {}
+        pending = [self.os_map[dep]] if self.os_map.get(dep) else []
+        while pending:
+            stage = pending.pop()
+            if stage.name in stages:
+                continue
+            stages[stage.name] = stage
+            for take in stage.takes:
+                provider = self.os_map.get(take.name)
+                if provider:
+                    pending.append(provider)
+
+        indeg = {name: 0 for name in stages}
+        consumers: "dict[str, list[Stage]]" = {name: [] for name in stages}
+        for stage in stages.values():
+            for take in stage.takes:
+                provider = self.os_map.get(take.name)
+                if provider:
+                    indeg[stage.name] += 1
+                    consumers[provider.name].append(stage)
+
+        queue = deque(stage for stage in stages.values() if indeg[stage.name] == 0)
+        ordered = []
+        while queue:
+            stage = queue.popleft()
+            ordered.append(stage)
+            for consumer in consumers[stage.name]:
+                indeg[consumer.name] -= 1
+                if indeg[consumer.name] == 0:
+                    queue.append(consumer)
+
+        if len(ordered) < len(stages):
+            cyclic = ", ".join(f"`{name}`" for name, n in indeg.items() if n > 0)
+            raise F4PGAException(message=f"Dependency cycle detected among stages {cyclic}")
+        return ordered
+
+    def _resolve_dependencies(self, dep: str):
         # Initialize the dependency status if necessary
         if self.deps_rebuilds.get(dep) is None:
             self.deps_rebuilds[dep] = 0
-        # Check if an explicit dependency is already resolved
-        paths = self.dep_paths.get(dep)
-        if paths and not self.os_map.get(dep):
-            return
-        # Check if a stage can provide the required dependency
-        provider = self.os_map.get(dep)
-        if not provider or provider.name in stages_checked:
-            return
 
+        skip_dep_warnings = set()
+        for provider in self._stages_in_order(dep):
+            self._resolve_stage(provider, skip_dep_warnings)
+
+    def _resolve_stage(self, provider: Stage, skip_dep_warnings: "set[str]"):
+        """
+        Resolve outputs of a stage, whose providers of inputs have already been resolved.
+        """
         # TODO: Check if the dependency is "on-demand" and force it in provider's
         # config if it is.
 
         for take in provider.takes:
-            self._resolve_dependencies(take.name, stages_checked, skip_dep_warnings)
+            if self.deps_rebuilds.get(take.name) is None:
+                self.deps_rebuilds[take.name] = 0
             # If any of the required dependencies is unavailable, then the
             # provider stage cannot be run
             take_paths = self.dep_paths.get(take.name)
@@ -163,7 +281,7 @@ class Flow:
             if take_paths is None:
                 # TODO: This won't trigger rebuild if an optional dependency got removed
                 will_differ = False
-            elif p_req_exists(take_paths):
+            elif self._req_exists(take_paths):
                 will_differ = self._dep_will_differ(take.name, take_paths, provider.name)
             else:
                 will_differ = True
@@ -179,22 +297,19 @@ class Flow:
                 self.run_stages.add(provider.name)
                 self.deps_rebuilds[take.name] += 1
 
-        outputs = module_map(
-            provider.module,
-            self._config_mod_runctx(
-                provider, self.cfg.get_r_env(provider.name).values, self.dep_paths, self.cfg.get_dependency_overrides()
-            ),
+        modrunctx = self._config_mod_runctx(
+            provider, self.cfg.get_r_env(provider.name).values, self.dep_paths, self.cfg.get_dependency_overrides()
         )
-        for output_paths in outputs.values():
-            if output_paths is not None:
-                if p_req_exists(output_paths) and self.f4cache:
-                    self._cache_deps(output_paths, self.f4cache)
+        outputs = module_map(provider.module, modrunctx)
+        if self.f4cache:
+            self._cache_deps(
+                [paths for paths in outputs.values() if (paths is not None) and self._req_exists(paths)], self.f4cache
+            )
 
-        stages_checked.add(provider.name)
         self.dep_paths.update(outputs)
 
         for _, out_paths in outputs.items():
-            if (out_paths is not None) and not (p_req_exists(out_paths)):
+            if (out_paths is not None) and not (self._req_exists(out_paths)):
                 self.run_stages.add(provider.name)
 
         # Verify module's outputs and add paths as values.
@@ -213,90 +328,136 @@ class Flow:
             if o_path is not None:
                 provider.value_overrides[f":{o.name}"] = outputs.get(o.name)
 
-    def print_resolved_dependencies(self, verbosity: int):
-        deps = list(self.deps_rebuilds.keys())
-        deps.sort()
+        # With the outputs known, bring the context up to date for executing the stage, so that it does not need to be
+        # built again from scratch.
+        modrunctx.config["produces"] = self._mod_runctx_produces(
+            provider, self.dep_paths, self.cfg.get_dependency_overrides()
+        )
+        ResolutionEnv(modrunctx.config["values"]).add_values(
+            {f":{o.name}": outputs[o.name] for o in provider.produces if outputs.get(o.name) is not None}
+        )
+        self._modrunctx[provider.name] = modrunctx
 
-        for dep in deps:
-            status = Fore.RED + "[X]" + Fore.RESET
-            source = Fore.YELLOW + "MISSING" + Fore.RESET
+    def print_resolved_dependencies(self, verbosity: int):
+        for dep in sorted(self.deps_rebuilds):
+            status, source = STATUS_UNRESOLVED, SOURCE_MISSING
             paths = self.dep_paths.get(dep)
+            provider = self.os_map.get(dep)
 
             if paths:
-                exists = p_req_exists(paths)
-                provider = self.os_map.get(dep)
+                exists = self._req_exists(paths)
                 if provider and provider.name in self.run_stages:
-                    status = Fore.YELLOW + ("[R]" if exists else "[S]") + Fore.RESET
-                    source = f"{Fore.BLUE + self.os_map[dep].name + Fore.RESET} -> {paths}"
+                    status = STATUS_REBUILD if exists else STATUS_SCHEDULED
+                    source = f"{Fore.BLUE}{provider.name}{Fore.RESET} -> {paths}"
                 elif exists:
-                    status = Fore.GREEN + ("[N]" if self.deps_rebuilds[dep] > 0 else "[O]") + Fore.RESET
+                    status = STATUS_CHANGED if self.deps_rebuilds[dep] > 0 else STATUS_UNCHANGED
                     source = paths
-            elif self.os_map.get(dep):
-                status = Fore.RED + "[U]" + Fore.RESET
-                source = f"{Fore.BLUE + self.os_map[dep].name + Fore.RESET} -> ???"
+            elif provider:
+                status, source = STATUS_UNREACHABLE, f"{Fore.BLUE}{provider.name}{Fore.RESET} -> ???"
 
-            sfprint(verbosity, f"    {Style.BRIGHT + status} " f"{dep + Style.RESET_ALL}:  {source}")
+            sfprint(verbosity, f"    {status} {dep}{Style.RESET_ALL}:  {source}")
 
-    def _build_dep(self, dep):
+    def _stage_r_env(self, stage_name: str) -> ResolutionEnv:
+        """
+        Get the resolution environment of a stage, for read-only use.
+        Environments are only memoized while building, when value overrides of stages are no longer updated.
+        """
+        r_env = self._r_envs.get(stage_name)
+        if r_env is None:
+            r_env = self.cfg.get_r_env(stage_name)
+            self._r_envs[stage_name] = r_env
+        return r_env
+
+    def _dep_build_paths(self, dep: str):
         provider = self.os_map.get(dep)
-        r_env = self.cfg.r_env if provider is None else self.cfg.get_r_env(provider.name)
-        paths = r_env.resolve(self.dep_paths.get(dep))
-        if not paths:
+        r_env = self.cfg.r_env if provider is None else self._stage_r_env(provider.name)
+        return r_env.resolve(self.dep_paths.get(dep))
+
+    def _dep_available(self, dep: str):
+        if not self._dep_build_paths(dep):
             sfprint(2, f"Dependency {dep} is unresolved.")
             return False
-        run = (provider.name in self.run_stages) if provider else False
+        return True
 
-        if p_req_exists(paths) and not run:
-            return True
-        else:
-            assert provider
-
-            any_dep_differ = False if (self.f4cache is not None) else True
-            for p_dep in provider.takes:
-                if not self._build_dep(p_dep.name):
-                    assert p_dep.spec != "req"
-                    continue
-                if self.f4cache is not None:
-                    any_dep_differ |= p_update_dep_statuses(self.dep_paths[p_dep.name], provider.name, self.f4cache)
-
-            # If dependencies remained the same, consider the dep as up-to date
-            # For example, when changing a comment in Verilog source code,
-            # the initial dependency resolution will report a need for complete
-            # rebuild, however, after the synthesis stage, the generated eblif
-            # will reamin the same, thus making it unnecessary to continue the
-            # rebuild process.
-            if (not any_dep_differ) and p_req_exists(paths):
+    def _plan_build(self) -> "list[tuple[Stage, list[str]]]":
+        """
+        Select stages which have to be visited to build the target, in the order in which they can be built.
+        Each stage is paired with its outputs that are requested (by the target or by selected consumers) and are either
+        missing or need to be rebuilt.
+        """
+        requested: "dict[str, list[str]]" = {}
+        provider = self.os_map.get(self.target)
+        if provider:
+            requested[provider.name] = [self.target]
+
+        build_order = []
+        for stage in reversed(self._stages_in_order(self.target)):
+            run = stage.name in self.run_stages
+            outdated = []
+            for dep in requested.get(stage.name, []):
+                paths = self._dep_build_paths(dep)
+                if paths and (run or not self._req_exists(paths)):
+                    outdated.append(dep)
+            if not outdated:
+                continue
+
+            build_order.append((stage, outdated))
+            for take in stage.takes:
+                provider = self.os_map.get(take.name)
+                if provider:
+                    deps = requested.setdefault(provider.name, [])
+                    if take.name not in deps:
+                        deps.append(take.name)
+
+        build_order.reverse()
+        return build_order
+
+    def _build_stage(self, provider: Stage, outdated: "list[str]"):
+        """
+        Build `outdated` outputs of a stage, whose inputs have already been built.
+        """
+        any_dep_differ = False if (self.f4cache is not None) else True
+        for p_dep in provider.takes:
+            if not self._dep_available(p_dep.name):
+                assert p_dep.spec != "req"
+                continue
+            if self.f4cache is not None:
+                any_dep_differ |= p_update_dep_statuses(self.dep_paths[p_dep.name], provider.name, self.f4cache)
+
+        # If dependencies remained the same, consider the dep as up-to date
+        # For example, when changing a comment in Verilog source code,
+        # the initial dependency resolution will report a need for complete
+        # rebuild, however, after the synthesis stage, the generated eblif
+        # will reamin the same, thus making it unnecessary to continue the
+        # rebuild process.
+        if (not any_dep_differ) and all(self._req_exists(self._dep_build_paths(dep)) for dep in outdated):
+            for dep in outdated:
                 sfprint(
                     2,
                     f"Skipping rebuild of `"
                     f"{Style.BRIGHT + dep + Style.RESET_ALL}` because all "
                     f"of it's dependencies remained unchanged",
                 )
-                return True
-
-            module_exec(
-                provider.module,
-                self._config_mod_runctx(
-                    provider,
-                    self.cfg.get_r_env(provider.name).values,
-                    self.dep_paths,
-                    self.cfg.get_dependency_overrides(),
-                ),
-            )
+            return
 
-            self.run_stages.discard(provider.name)
+        module_exec(provider.module, self._exec_mod_runctx(provider))
 
-            for product in provider.produces:
-                if (product.spec == "req") and not p_req_exists(paths):
-                    raise DependencyNotProducedException(dep, provider.name)
-                prod_paths = self.dep_paths[product.name]
-                if (prod_paths is not None) and p_req_exists(paths) and self.f4cache:
-                    self._cache_deps(prod_paths, self.f4cache)
+        self.run_stages.discard(provider.name)
+        # The module might have created or removed files
+        self._exists_cache.clear()
 
-        return True
+        missing = [dep for dep in outdated if not self._req_exists(self._dep_build_paths(dep))]
+        if missing and any(product.spec == "req" for product in provider.produces):
+            raise DependencyNotProducedException(missing[0], provider.name)
+        if self.f4cache and not missing:
+            self._cache_deps(
+                [self.dep_paths[p.name] for p in provider.produces if self.dep_paths[p.name] is not None], self.f4cache
+            )
 
     def execute(self):
-        self._build_dep(self.target)
+        if self._dep_available(self.target):
+            for stage, outdated in self._build_order:
+                self._build_stage(stage, outdated)
         if self.f4cache:
             self._cache_deps(self.dep_paths[self.target], self.f4cache)
             p_update_dep_statuses(self.dep_paths[self.target], "__target", self.f4cache)
@@ -313,42 +474,31 @@ class DependencyNotProducedException(F4PGAException):
         self.message = f"Stage `{self.provider}` did not produce promised dependency `{self.dep_name}`"
 
 
-def p_req_exists(r):
+def p_iter_paths(paths):
     """
-    Checks whether a dependency exists on a drive.
+    Iterate over all paths of a dependency (or a list of dependencies).
     """
-    if type(r) is str:
-        if not Path(r).exists():
-            return False
-    elif type(r) is list:
-        return not (False in map(p_req_exists, r))
+    if isinstance(paths, str):
+        yield paths
+    elif isinstance(paths, list):
+        for p in paths:
+            yield from p_iter_paths(p)
+    elif isinstance(paths, dict):
+        for p in paths.values():
+            yield from p_iter_paths(p)
     else:
-        raise Exception(f"Requirements can be currently checked only for single paths, or path lists (reason: {r})")
-    return True
+        raise RuntimeError(f"paths is of type {type(paths)}")
 
 
 def p_update_dep_statuses(paths, consumer: str, f4cache: F4Cache):
-    if type(paths) is str:
-        return f4cache.update(Path(paths), consumer)
-    elif type(paths) is list:
-        for p in paths:
-            return p_update_dep_statuses(p, consumer, f4cache)
-    elif type(paths) is dict:
-        for _, p in paths.items():
-            return p_update_dep_statuses(p, consumer, f4cache)
-    fatal(-1, "WRONG PATHS TYPE")
-
-
-def p_dep_differ(paths, consumer: str, f4cache: F4Cache):
     """
-    Check if a dependency differs from its last version, lack of dependency is treated as "differs".
+    Update statuses of all files of a dependency, returns True if any of them changed.
     """
-    if type(paths) is str:
-        if not Path(paths).exists():
-            return True
-        return f4cache.get_status(paths, consumer) != "same"
-    elif type(paths) is list:
-        return True in [p_dep_differ(p, consumer, f4cache) for p in paths]
-    elif type(paths) is dict:
-        return True in [p_dep_differ(p, consumer, f4cache) for _, p in paths.items()]
-    return False
+    if isinstance(paths, str):
+        return f4cache.update(Path(paths), consumer)
+    elif isinstance(paths, list):
+        # Every file has to be updated, so no short-circuiting here
+        return True in [p_update_dep_statuses(p, consumer, f4cache) for p in paths]
+    elif isinstance(paths, dict):
+        return True in [p_update_dep_statuses(p, consumer, f4cache) for p in paths.values()]
+    fatal(-1, "WRONG PATHS TYPE")
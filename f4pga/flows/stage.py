@@ -75,8 +75,9 @@ class Stage:
 
         self.module = get_module(resolve_modstr(stage_def["module"]))(stage_def.get("params"))
 
+        # Copy, as overrides get modified by flows while `stage_def` may be shared (see `make_flow_config`).
         values = stage_def.get("values")
-        self.value_overrides = values if values is not None else {}
+        self.value_overrides = dict(values) if values is not None else {}
 
         mod_io = module_io(self.module)
         self.takes = [StageIO(input) for input in mod_io["takes"]]
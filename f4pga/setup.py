@@ -96,6 +96,14 @@ setuptools_setup(
     classifiers=[],
     python_requires=">=3.6",
     install_requires=list(set(get_requirements(requirementsFile))),
+    extras_require={
+        # Faster checksums for tracking changes of dependencies
+        "xxhash": ["xxhash>=2.0.0"],
+        # Faster loading and saving of the dependency cache and of designs processed by yosys_split_inouts
+        "orjson": ["orjson"],
+        # Processing designs too big to be loaded at once by yosys_split_inouts
+        "ijson": ["ijson>=3.1"],
+    },
     entry_points={
         "console_scripts": [
             "f4pga = f4pga.flows:main",
@@ -69,10 +69,54 @@ the resulting design would be:
 
 
 from pathlib import Path
+from os import getpid, replace as os_replace
 from os.path import splitext
-import simplejson as json
+from mmap import mmap, ACCESS_READ
+from concurrent.futures import ProcessPoolExecutor
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
+# Designs written by Yosys can be huge and orjson parses and serializes them several times faster than simplejson.
+# The output of both is semantically equivalent, not byte-identical: orjson writes non-ASCII characters as they are,
+# where simplejson escapes them as \uXXXX. Yosys' read_json accepts either form.
+try:
+    from orjson import dumps as _orjson_dumps, loads as json_loads, OPT_INDENT_2, OPT_SORT_KEYS
+
+    def json_dumps(obj, sort_keys=False) -> bytes:
+        return _orjson_dumps(obj, option=OPT_INDENT_2 | OPT_SORT_KEYS if sort_keys else OPT_INDENT_2)
+
+    def json_load_file(path: Path):
+        # orjson can parse the file mapped into memory, without copying it first
+        with path.open("rb") as fp:
+            if path.stat().st_size == 0:
+                return json_loads(fp.read())
+            with mmap(fp.fileno(), 0, access=ACCESS_READ) as mm, memoryview(mm) as data:
+                return json_loads(data)
+
+except ImportError:
+    from simplejson import dumps as _json_dumps, loads as json_loads
+
+    def json_dumps(obj, sort_keys=False) -> bytes:
+        return _json_dumps(obj, sort_keys=sort_keys, indent=2).encode()
+
+    def json_load_file(path: Path):
+        return json_loads(path.read_bytes())
+
+
+# ijson allows processing designs too big to be loaded at once, one module at a time.
+try:
+    from ijson import basic_parse as ijson_basic_parse, ObjectBuilder
+except ImportError:
+    ijson_basic_parse = None
+
+# Designs smaller than that are loaded at once, as parsing them incrementally is considerably slower.
+STREAM_MIN_SIZE = 256 * 1024 * 1024
+
+# Size of buffers used when a design is processed incrementally, the default ones result in a lot of small reads.
+STREAM_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Directions of the ports an inout is split into, suffixes of their names and keys of their nets in the net map
+SPLIT_PORTS = (("input", "$inp", "i"), ("output", "$out", "o"))
+
 
 def find_top_module(design):
     """
@@ -80,12 +124,19 @@ def find_top_module(design):
     an exception if none was found.
     """
     for name, module in design["modules"].items():
-        attrs = module["attributes"]
-        if "top" in attrs and int(attrs["top"]) == 1:
+        if is_top_module(module):
             return name
     raise RuntimeError("No top-level module found in the design!")
 
 
+def is_top_module(module):
+    """
+    Checks whether the module is marked as the top-level one.
+    """
+    attrs = module["attributes"]
+    return "top" in attrs and int(attrs["top"]) == 1
+
+
 def get_nets(bits):
     """
     Returns a set of numbers corresponding to net indices effectively skipping
@@ -94,41 +145,24 @@ def get_nets(bits):
     >>> get_nets([0, 1, 2, "0", "1", "x", 3, 4, 5])
     {0, 1, 2, 3, 4, 5}
     """
-    return set([n for n in bits if isinstance(n, int)])
+    return {n for n in bits if type(n) is int}
 
 
-def get_free_net(nets):
+def get_max_net(bits):
     """
-    Given a set of used net indices, returns a new, free index.
+    Returns the highest net index in bits or -1 if there are connections to
+    consts only.
 
-    >>> get_free_net({0, 1, 2,    4, 5, 6})
-    3
-    >>> get_free_net({0, 1, 2, 3, 4, 5, 6})
-    7
+    >>> get_max_net([0, 1, 5, "0", "1", "x", 3, 4])
+    5
+    >>> get_max_net(["0", "x"])
+    -1
     """
-    sorted_nets = sorted(list(nets))
+    return max((n for n in bits if type(n) is int), default=-1)
 
-    # Find a gap in the sequence
-    for i in range(len(nets) - 1):
-        n0 = sorted_nets[i]
-        n1 = sorted_nets[i + 1]
-        if n1 != (n0 + 1):
-            return n0 + 1
 
-    # No gap was found, return max + 1.
-    return sorted_nets[-1] + 1
-
-
-def main(input: str, output: str = None):
-    if output is None:
-        output = splitext(input)[0] + "_out.json"
-
-    with Path(input).open("r") as fp:
-        design = json.load(fp)
-
-    module_name = find_top_module(design)
-
-    # Take a module from the design and split all of its inout ports into pairs of inputs and outputs.
+def split_inouts(module, verbose=False):
+    # Take a module of the design and split all of its inout ports into pairs of inputs and outputs.
     # Newly created ports are given suffixed.
     # For example an inout port named "A" is going to be replaced by a pair consisting of "A_$inp" and "A_$out" ports.
 
@@ -145,53 +179,59 @@ def main(input: str, output: str = None):
     # The net map is a dict indexed by indices of nets associated with inout ports.
     # Each item contains a dict like {"i": int, "o": int} with indices of the inout net split products.
 
-    # Get the module
-    module = design["modules"][module_name]
+    # Remove all inout ports from the module
+    ports = module["ports"]
+    inouts = {name: ports.pop(name) for name in [k for k, v in ports.items() if v["direction"] == "inout"]}
+    inout_nets = set()
+    for port in inouts.values():
+        inout_nets |= get_nets(port["bits"])
 
-    # Find indices of all used nets
-    nets = set()
-    for port in module["ports"].values():
-        nets |= get_nets(port["bits"])
+    # Find the highest index of used nets, new nets are allocated past it
+    max_net = max(inout_nets, default=-1)
+    for port in ports.values():
+        max_net = max(max_net, get_max_net(port["bits"]))
 
     for netname in module["netnames"].values():
-        nets |= get_nets(netname["bits"])
-
-    for cell in module["cells"].values():
-        for connection in cell["connections"].values():
-            nets |= get_nets(connection)
+        max_net = max(max_net, get_max_net(netname["bits"]))
 
-    # Get all inout ports
-    inouts = {k: v for k, v in module["ports"].items() if v["direction"] == "inout"}
+    # Also find connections of cells to inout nets, as only these may need to be remapped
+    inout_connections = []
+    for cell_name, cell in module["cells"].items():
+        for port_name, connection in cell["connections"].items():
+            max_net = max(max_net, get_max_net(connection))
+            if "port_directions" in cell and not inout_nets.isdisjoint(connection):
+                inout_connections.append((cell_name, port_name))
 
     # Split ports
     new_ports = {}
     net_map = {}
     port_map = []
     for name, port in inouts.items():
-        # Remove the inout port from the module
-        del module["ports"][name]
-        nets -= get_nets(port["bits"])
+        # Only connections to nets get remapped, the consts stay in place
+        net_positions = [i for i, n in enumerate(port["bits"]) if type(n) is int]
 
-        # Make an input and output port
-        for dir in ["input", "output"]:
-            new_name = name + "_$" + dir[:3]
-            new_port = {"direction": dir, "bits": []}
+        # Make an input and output port.
+        # Bits of the new ports are preallocated copies of the inout port bits, except that the last one takes over the
+        # list of the inout port, which is no longer needed. Every net is read before it gets overwritten.
+        new_bits = [list(port["bits"]) for _ in SPLIT_PORTS[1:]] + [port["bits"]]
+        for (dir, suffix, key), bits in zip(SPLIT_PORTS, new_bits):
+            new_name = name + "_" + suffix
+            new_port = {"direction": dir, "bits": bits}
 
             print("Mapping port '{}' to '{}'".format(name, new_name))
 
-            for n in port["bits"]:
-                if isinstance(n, int):
-                    mapped_n = get_free_net(nets)
+            for i in net_positions:
+                n = bits[i]
+                max_net += 1
+                mapped_n = max_net
+                if verbose:
                     print("Mapping net {} to {} ({})".format(n, mapped_n, dir))
 
-                    if n not in net_map:
-                        net_map[n] = {}
-                    net_map[n][dir[0]] = mapped_n
-                    nets.add(mapped_n)
+                if n not in net_map:
+                    net_map[n] = {}
+                net_map[n][key] = mapped_n
 
-                    new_port["bits"].append(mapped_n)
-                else:
-                    new_port["bits"].append(n)
+                bits[i] = mapped_n
 
             port_map.append(
                 (
@@ -202,72 +242,243 @@ def main(input: str, output: str = None):
             new_ports[new_name] = new_port
 
     # Add inputs and outputs
-    module["ports"].update(new_ports)
+    ports.update(new_ports)
 
     netnames = module["netnames"]
 
-    # Remove netnames related to inout ports
-    for name, net in list(netnames.items()):
+    # Remove netnames related to inout ports and remapped nets.
+    # Names are collected first and removed afterwards, so that netnames don't have to be copied to be iterated over.
+    removed_netnames = []
+    for name, net in netnames.items():
         if name in inouts:
-            print(f"Removing netname '{name}'")
-            del netnames[name]
+            removed_netnames.append(name)
+            continue
 
-    # Remove remapped nets
-    for name, net in list(netnames.items()):
         # Remove "bits" used by the net that were re-mapped.
-        if len(set(net["bits"]) & set(net_map.keys())):
+        if any(b in net_map for b in net["bits"]):
             # Remove
             net["bits"] = ["x" if b in net_map else b for b in net["bits"]]
 
             # If there is nothing left, remove the whole net.
-            if all([b == "x" for b in net["bits"]]):
-                print(f"Removing netname '{name}'")
-                del netnames[name]
+            if all(b == "x" for b in net["bits"]):
+                removed_netnames.append(name)
+
+    for name in removed_netnames:
+        print(f"Removing netname '{name}'")
+        del netnames[name]
 
     # Add netnames related to new input and output ports
     for name, port in new_ports.items():
         netnames[name] = {"hide_name": 0, "bits": port["bits"], "attributes": {}}
 
     # Remap cell connections that mention inout ports being split.
-    # Loop over all cells and their ports.
-    # If a port contains a connection to an inout net, then the connection is remapped according to the given
-    # net_map.
+    # Loop over the cell ports connected to inout nets, found while looking for the highest net index.
+    # The connection is remapped according to the given net_map.
     # Only ports which names ends on "_$inp" and "_$out" are affected.
 
-    module = design["modules"][module_name]
     cells = module["cells"]
 
-    # Process cells
-    for name, cell in cells.items():
-        if "port_directions" not in cell:
+    # Flat maps of inout nets to nets of each of the split ports, so that whole connections can be remapped at once
+    port_net_maps = {key: {n: mapped[key] for n, mapped in net_map.items()} for _, _, key in SPLIT_PORTS}
+
+    # Process cell connections
+    for name, port_name in inout_connections:
+        cell = cells[name]
+        port_dir = cell["port_directions"][port_name]
+        port_nets = cell["connections"][port_name]
+
+        # Remove connections to the output net from input port and vice
+        # versa.
+        for dir, suffix, key in SPLIT_PORTS:
+            if port_dir == dir and port_name.endswith(suffix):
+                port_net_map = port_net_maps[key]
+                if verbose:
+                    for i, n in enumerate(port_nets):
+                        if n in port_net_map:
+                            mapped_n = port_net_map[n]
+                            print("Mapping connection {}.{}[{}] from {} to {}".format(name, port_name, i, n, mapped_n))
+                port_nets[:] = [port_net_map.get(n, n) for n in port_nets]
+                break
+
+
+def build_value(events):
+    """
+    Builds a single JSON value out of ijson events, consuming only the events
+    belonging to it.
+    """
+    builder = ObjectBuilder()
+    depth = 0
+    for event, value in events:
+        builder.event(event, value)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+        if depth == 0:
+            return builder.value
+
+
+def iter_design(fp):
+    """
+    Incrementally parses a design, yielding its top-level entries other than
+    "modules" as (key, value, False) and modules as (name, module, True).
+    Only the entry being yielded is held in memory.
+    """
+    events = ijson_basic_parse(fp, buf_size=STREAM_BUFFER_SIZE, use_float=True)
+    next(events)  # start_map of the design
+    for event, key in events:
+        if event == "end_map":
+            return
+        if key != "modules":
+            yield key, build_value(events), False
             continue
 
-        port_directions = cell["port_directions"]
-        connections = cell["connections"]
+        next(events)  # start_map of modules
+        for event, name in events:
+            if event == "end_map":
+                break
+            yield name, build_value(events), True
 
-        # Process cell connections
-        for port_name, port_nets in list(connections.items()):
-            # Skip if no net of this connection were remapped
-            if len(set(net_map.keys()) & set(port_nets)) == 0:
-                continue
 
-            # Remove connections to the output net from input port and vice
-            # versa.
-            for dir in ["input", "output"]:
-                if port_directions[port_name] == dir and port_name.endswith("$" + dir[:3]):
-                    for i, n in enumerate(port_nets):
-                        if n in net_map:
-                            mapped_n = net_map[n][dir[0]]
-                            port_nets[i] = mapped_n
-                            print("Mapping connection {}.{}[{}] from {} to {}".format(name, port_name, i, n, mapped_n))
+def split_inouts_streaming(fp_in, fp_out, verbose=False):
+    """
+    Splits inouts of the top-level module of a design read from fp_in and
+    writes the result to fp_out, keeping only one module in memory at a time
+    (apart from the top-level one).
+
+    Non-top modules are written in the order they are read and the top-level
+    module goes last. Layout of the output matches that of the output written
+    in one go.
+
+    >>> from io import BytesIO
+    >>> design = {"creator": "Yosys", "modules": {
+    ...     "top": {"attributes": {"top": "1"}, "cells": {},
+    ...             "ports": {"A": {"direction": "inout", "bits": [2, "0"]}},
+    ...             "netnames": {"A": {"hide_name": 0, "bits": [2, "0"], "attributes": {}}}},
+    ...     "IOBUF": {"attributes": {}, "cells": {}, "ports": {}, "netnames": {}}}}
+    >>> fp_out = BytesIO()
+    >>> split_inouts_streaming(BytesIO(json_dumps(design)), fp_out)
+    Mapping port 'A' to 'A_$inp'
+    Mapping port 'A' to 'A_$out'
+    Removing netname 'A'
+    >>> split_inouts(design["modules"]["top"])
+    Mapping port 'A' to 'A_$inp'
+    Mapping port 'A' to 'A_$out'
+    Removing netname 'A'
+    >>> json_loads(fp_out.getvalue()) == design
+    True
+    >>> list(json_loads(fp_out.getvalue())["modules"])
+    ['IOBUF', 'top']
+    """
+
+    def write_entry(sep, key, value, indent):
+        fp_out.write(sep + json_dumps(key) + b": " + json_dumps(value).replace(b"\n", b"\n" + indent))
+
+    def write_top_and_close_modules():
+        if top is None:
+            raise RuntimeError("No top-level module found in the design!")
+        module_name, module = top
+        split_inouts(module, verbose)
+        write_entry(modules_sep, module_name, module, b"    ")
+        fp_out.write(b"\n  }")
+
+    fp_out.write(b"{")
+    sep = b"\n  "
+    modules_sep = b"\n    "
+    top = None
+    # None before modules, True while reading them and False after
+    in_modules = None
+    for key, value, is_module in iter_design(fp_in):
+        if not is_module:
+            if in_modules:
+                write_top_and_close_modules()
+                in_modules = False
+            write_entry(sep, key, value, b"  ")
+            sep = b",\n  "
+            continue
+
+        if in_modules is None:
+            fp_out.write(sep + b'"modules": {')
+            sep = b",\n  "
+            in_modules = True
+        elif not in_modules:
+            raise RuntimeError("Modules of the design are split into multiple objects!")
+
+        if top is None and is_top_module(value):
+            top = (key, value)
+            continue
+        write_entry(modules_sep, key, value, b"    ")
+        modules_sep = b",\n    "
+
+    if in_modules is None:
+        raise RuntimeError("No top-level module found in the design!")
+    if in_modules:
+        write_top_and_close_modules()
+    fp_out.write(b"\n}")
+
+
+def process_design(
+    input: str,
+    output: str = None,
+    verbose: bool = False,
+    canonical: bool = False,
+    stream_min_size: int = STREAM_MIN_SIZE,
+):
+    """
+    Splits inouts of the top-level module of the design stored in the input
+    file and writes the result to the output file (by default the input path
+    with "_out" added to its stem).
+    Designs of at least stream_min_size bytes are processed incrementally if
+    ijson is available.
+    """
+    if output is None:
+        output = splitext(input)[0] + "_out.json"
 
-    with Path(output).open("w") as fp:
-        json.dump(design, fp, sort_keys=True, indent=2)
+    # Modules can't be sorted when they are written as soon as they are read
+    if not canonical and ijson_basic_parse is not None and Path(input).stat().st_size >= stream_min_size:
+        # The output is written while the input is still being read, so it goes to a temporary file first, which
+        # replaces the output only once the whole design has been processed.
+        tmp = Path(output).with_name(f"{Path(output).name}.{getpid()}.tmp")
+        try:
+            # ijson reads chunks of the requested size by itself, so the input doesn't need another buffer
+            with Path(input).open("rb", buffering=0) as fp_in:
+                with tmp.open("wb", buffering=STREAM_BUFFER_SIZE) as fp_out:
+                    split_inouts_streaming(fp_in, fp_out, verbose)
+            os_replace(str(tmp), output)
+        except BaseException:
+            if tmp.exists():
+                tmp.unlink()
+            raise
+        return
+
+    design = json_load_file(Path(input))
+    split_inouts(design["modules"][find_top_module(design)], verbose)
+    Path(output).write_bytes(json_dumps(design, canonical))
+
+
+def main(inputs: "list[str]", output: str = None, verbose: bool = False, canonical: bool = False, jobs: int = 1):
+    if len(inputs) > 1 and output is not None:
+        raise RuntimeError("An output can be specified only for a single input!")
+
+    if jobs <= 1 or len(inputs) <= 1:
+        for input in inputs:
+            process_design(input, output, verbose, canonical)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(inputs))) as pool:
+        futures = [pool.submit(process_design, input, None, verbose, canonical) for input in inputs]
+        for future in futures:
+            future.result()
 
 
 if __name__ == "__main__":
     parser = ArgumentParser(description=__doc__, formatter_class=RawDescriptionHelpFormatter)
-    parser.add_argument("-i", required=True, type=str, help="Input JSON")
-    parser.add_argument("-o", default=None, type=str, help="Output JSON")
+    parser.add_argument("-i", required=True, type=str, nargs="+", help="Input JSON(s)")
+    parser.add_argument("-o", default=None, type=str, help="Output JSON, only for a single input")
+    parser.add_argument("-j", default=1, type=int, help="Number of inputs processed in parallel")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Report remapping of every net and connection")
+    parser.add_argument(
+        "--canonical", action="store_true", help="Sort keys of all objects in the output, e.g. for comparing designs"
+    )
     args = parser.parse_args()
-    main(args.i, args.o)
+    main(args.i, args.o, args.verbose, args.canonical, args.j)